@@ -1,8 +1,8 @@
 # python_bridge/filter_reddit.py
 # Usage: python python_bridge/filter_reddit.py
 
-import json
 import os
+import orjson
 
 # --- CONFIGURATION ---
 # Path to the massive file you downloaded (Update this path if needed)
@@ -13,6 +13,13 @@ OUTPUT_FILE = "./python_bridge/filtered_india_context.jsonl"
 MIN_SCORE = 5        # Only keep comments with 5+ upvotes
 MIN_LENGTH = 50      # Only keep substantial comments (no "lol" or "this")
 MAX_ITEMS = 50000    # Stop after gathering this many high-quality items
+READ_BUFFER = 4 * 1024 * 1024  # Large binary reads; orjson parses the raw bytes directly
+
+# Byte-level rejects, checked before paying for a full parse.
+# A line can never be shorter than a minimal object wrapping a MIN_LENGTH body.
+_MIN_LINE_BYTES = MIN_LENGTH + len(b'{"body":""}')
+_DEL = b'"body":"[deleted]"'
+_REM = b'"body":"[removed]"'
 
 def filter_data():
     print(f"🌊 STARTING FILTER: Streaming from {INPUT_FILE}...")
@@ -23,11 +30,13 @@ def filter_data():
         return
 
     count = 0
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as out_f:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as in_f:
+    with open(OUTPUT_FILE, 'wb') as out_f:
+        with open(INPUT_FILE, 'rb', buffering=READ_BUFFER) as in_f:
             for line in in_f:
+                if len(line) < _MIN_LINE_BYTES or _DEL in line or _REM in line:
+                    continue
                 try:
-                    data = json.loads(line)
+                    data = orjson.loads(line)
                     
                     # 1. Check Score (Upvotes)
                     score = data.get('score', 0)
@@ -45,7 +54,8 @@ def filter_data():
                         "source": "r/India",
                         "date": data.get('created_utc', 0)
                     }
-                    out_f.write(json.dumps(clean_obj) + "\n")
+                    out_f.write(orjson.dumps(clean_obj))
+                    out_f.write(b"\n")
                     
                     count += 1
                     if count % 1000 == 0:
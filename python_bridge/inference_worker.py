@@ -1,6 +1,17 @@
 # python_bridge/inference_worker.py
 # SYSTEM V5.1: HTTP MICROSERVICE BRAIN (FastAPI + Uvicorn)
-# UPDATED: Added Global GPU Lock to prevent Metal/MPS Crashes on M-Series Chips
+# UPDATED: All Metal/MPS model work runs on one dedicated GPU executor thread (no shared lock) to prevent crashes on M-Series Chips
+
+import os
+
+# --- THREAD POOLS ---
+# Must be sized before torch / tokenizers are imported or the env vars are ignored
+CPU_COUNT = os.cpu_count() or 1
+# Half the cores for embedding math; the rest serve requests and MLX host-side work
+EMBED_THREADS = max(1, CPU_COUNT // 2)
+os.environ.setdefault("OMP_NUM_THREADS", str(EMBED_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(EMBED_THREADS))
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
 
 import sys
 import json
@@ -9,43 +20,205 @@ import io
 import re
 import urllib.parse
 import hashlib
-import networkx as nx 
+import zlib
+import math
+import time
+import asyncio
+import httpx
 import lancedb
-import requests
-import datetime
+import pyarrow as pa
 import uvicorn
 import threading 
-from fastapi import FastAPI, HTTPException
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Any
 
 # MLX & Intelligence Modules
+import numpy as np
+import torch
 from pypdf import PdfReader
 from sentence_transformers import SentenceTransformer
-from mlx_vlm import load, generate
+from mlx_vlm import load, stream_generate
 from PIL import Image
 from duckduckgo_search import DDGS 
 
+# Intra-op threads drive the MiniLM matmuls on CPU; keep inter-op small
+torch.set_num_threads(EMBED_THREADS)
+torch.set_num_interop_threads(2)
+
 # --- CONFIGURATION ---
 MODEL_PATH = "mlx-community/Phi-3.5-vision-instruct-4bit"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2" 
-DB_PATH = "./knowledge_db" 
+# "onnx" (default): int8-quantized MiniLM on ONNX Runtime (CPU), off the Metal device entirely
+# "torch": SentenceTransformer on PyTorch (fp16 on MPS), serialized with generation on gpu_executor
+EMBED_BACKEND = os.getenv("ORACULUM_EMBED_BACKEND", "onnx")
+# Pre-quantized graph shipped in the model repo (use model_qint8_avx512_vnni.onnx on x86)
+EMBED_ONNX_FILE = os.getenv("ORACULUM_EMBED_ONNX_FILE", "onnx/model_qint8_arm64.onnx")
+DB_PATH = os.getenv("ORACULUM_DB", "./knowledge_db")
+# Set ORACULUM_LIVE=0 for offline-only memory (no DDG fallback / write-back)
+ENABLE_LIVE_FALLBACK = os.getenv("ORACULUM_LIVE", "1") == "1"
 USER_AGENT = 'OraculumMarketBot/1.0 (Student Project)'
+UPSTREAM_HOSTS = ("https://www.reddit.com", "https://en.wikipedia.org", "https://world.openfoodfacts.org")
 PORT = 8003 
+EMBED_CACHE_SIZE = 2048    # Distinct texts kept in the embedding cache
+EMBED_CACHE_TTL = 600      # Seconds before a cached embedding is recomputed
+RESEARCH_CACHE_SIZE = 512  # Distinct topics kept for /research and /get_facts
+RESEARCH_CACHE_TTL = 3600  # Seconds before an upstream answer is fetched again
+EMBED_BATCH_MAX = 32       # Most concurrent embed requests coalesced into one encode
+EMBED_BATCH_WINDOW = 0.005 # Seconds the batcher waits for company after the first request
+HITS_CACHE_SIZE = 4096     # Distinct query vectors kept in the memory-bank hit cache
+HITS_CACHE_TTL = 300       # Seconds before a cached memory-bank lookup is re-run
+VECTOR_DIM = 384  # all-MiniLM-L6-v2 output size
+USER_TAG = "<|user|>"
+END_MARKER = "<|end|>"  # Phi-3.5 turn terminator; generation stops once it is emitted
+IMAGE_DRAFT_SIZE = (1024, 1024)  # Uploads are shrunk to fit this box (JPEGs decoded at the nearest DCT scale)
+IMAGE_CACHE_SIZE = 64      # Decoded uploads kept (<= 4 MiB each after shrinking, so <= 256 MiB total)
+IMAGE_CACHE_TTL = 600      # Seconds before a cached image is decoded again
+PDF_FINGERPRINT_EDGE = 4096  # Base64 chars hashed from each end of a PDF for the table cache
+PDF_CHUNK_TOKENS = 200     # Window size in MiniLM word-pieces (model limit is 256)
+PDF_CHUNK_STRIDE = 150     # Window step; consecutive chunks overlap by 50 tokens
+SPECULATE_MIN_ROWS = 1_000  # Memory bank smaller than this: always race the web search
+SPECULATE_MISS_RATE = 0.5   # ...or when this share of past lookups for the query came back empty
+SPECULATE_MIN_LOOKUPS = 2   # Lookups needed before a query's miss rate is trusted
+RECALL_STATS_SIZE = 4096    # Distinct queries tracked for the speculation policy
+ANN_INDEX_MIN_ROWS = 10_000  # Below this a flat scan is as fast as IVF-PQ
+ANN_REINDEX_EVERY = 5_000    # Rebuild the index after this many live-fallback inserts
+ANN_NPROBES = 20             # IVF partitions probed per query
+ANN_REFINE_FACTOR = 10       # PQ candidates re-ranked on full vectors per hit (PQ alone loses ~1/3 of top-5)
+
+# Vectors are stored as float16: half the bytes per flat-scan row, same top-k at 384 dims
+PDF_TABLE_SCHEMA = pa.schema([
+    pa.field("vector", pa.list_(pa.float16(), VECTOR_DIM)),
+    pa.field("text", pa.string()),
+])
+
+# --- CACHES ---
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after insertion."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._data[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class EmbedBatcher:
+    """Coalesces concurrent single-text embeds into one batched encode call."""
+
+    def __init__(self, max_batch, window):
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task: self._task.cancel()
+
+    async def embed(self, text, key):
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, key, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0: break
+                try: batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError: break
+
+            texts = [text for text, _, _ in batch]
+            keys = [key for _, key, _ in batch]
+            try:
+                # Encode runs in a worker thread so the event loop keeps accepting requests
+                vecs = await run_in_threadpool(_encode_and_cache, texts, keys, len(texts))
+            except Exception as e:
+                for _, _, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+                continue
+            for (_, _, fut), vec in zip(batch, vecs):
+                if not fut.done(): fut.set_result(vec)
 
 # --- GLOBAL STATE ---
-app = FastAPI(title="Oraculum Neural Engine")
-memory_graph = nx.DiGraph()
+# orjson: C-level serialization straight to bytes for the long LLM/RAG string payloads
+app = FastAPI(title="Oraculum Neural Engine", default_response_class=ORJSONResponse)
+# Graph memory: topic -> {agent: (opinion snippet, sentiment)}, latest opinion per agent
+memory_by_topic = defaultdict(dict)
+memory_lock = threading.Lock()  # Writers only; readers iterate a list() snapshot
+agent_shards = {}  # Agent name -> feed shard (0-2), hashed once per agent
 model = None
 processor = None
 embed_model = None
 db = None
 knowledge_table = None
+http_client = None  # Shared keep-alive client for Reddit / Wikipedia / OpenFoodFacts
+embed_batcher = None  # Started on the server's event loop at startup
 
-# --- CRITICAL: GPU LOCK ---
+# --- CRITICAL: GPU EXECUTOR ---
 # Metal (MPS) cannot handle parallel command buffer commits from threads.
-# We must serialize all model access.
-gpu_lock = threading.Lock()
+# Every model call runs on this one thread; requests queue on it instead of parking pool threads on a lock.
+gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mps")
+# Serializes per-PDF table creation (embedding alone does not serialize it)
+_pdf_table_lock = threading.Lock()
+
+# Query embeddings keyed by SHA-256 of the text; memory-bank lookups keyed by query-vector digest
+_embed_cache = TTLCache(EMBED_CACHE_SIZE, EMBED_CACHE_TTL)
+_hits_cache = TTLCache(HITS_CACHE_SIZE, HITS_CACHE_TTL)
+# Upstream research / fact-check answers keyed by normalized topic (successes only)
+_research_cache = TTLCache(RESEARCH_CACHE_SIZE, RESEARCH_CACHE_TTL)
+_facts_cache = TTLCache(RESEARCH_CACHE_SIZE, RESEARCH_CACHE_TTL)
+# Decoded PIL images keyed by SHA-1 of the base64 upload
+_image_cache = TTLCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL)
+
+# PDF RAG tables keyed by cheap upload fingerprint -> opened LanceDB table
+_pdf_table_cache = {}
+# Table names known to exist; seeded at startup so lookups never list the DB directory
+_known_tables = set()
+
+# Speculative live-web lookups: normalized query -> [empty lookups, total lookups]
+_web_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ddg")
+_recall_stats = {}
+
+# IVF-PQ maintenance for memory_bank
+_index_lock = threading.Lock()
+_rows_since_index = 0
 
 # --- REQUEST MODELS ---
 class GenerateRequest(BaseModel):
@@ -65,19 +238,27 @@ class QueryRequest(BaseModel):
 # --- LIFECYCLE STARTUP ---
 @app.on_event("startup")
 async def startup_event():
-    global model, processor, embed_model, db, knowledge_table
+    global model, processor, embed_model, db, knowledge_table, http_client, embed_batcher
     print("🧠 BRAIN SERVER: Loading Models...", flush=True)
+    http_client = httpx.AsyncClient(
+        headers={'User-Agent': USER_AGENT}, timeout=6, http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32)
+    )
+    embed_batcher = EmbedBatcher(EMBED_BATCH_MAX, EMBED_BATCH_WINDOW)
+    embed_batcher.start()
     
     try:
-        # Load models inside lock just to be safe, though startup is sequential
-        with gpu_lock:
-            model, processor = load(MODEL_PATH, trust_remote_code=True)
-            embed_model = SentenceTransformer(EMBEDDING_MODEL)
+        # Load on the GPU thread so Metal state is created where it will be used
+        loop = asyncio.get_running_loop()
+        model, processor = await loop.run_in_executor(gpu_executor, lambda: load(MODEL_PATH, trust_remote_code=True))
+        embed_model = await loop.run_in_executor(gpu_executor, load_embedder)
         
         db = lancedb.connect(DB_PATH)
-        existing_tables = db.table_names()
-        if "memory_bank" in existing_tables:
+        _known_tables.update(db.table_names())
+        if "memory_bank" in _known_tables:
             knowledge_table = db.open_table("memory_bank")
+            # First build takes minutes on a large bank: train off the startup path, flat scan until then
+            threading.Thread(target=_rebuild_index_worker, args=(False,), daemon=True).start()
             print("✅ BRAIN: Memory Bank Loaded", flush=True)
         else:
             knowledge_table = None
@@ -88,116 +269,402 @@ async def startup_event():
         print(f"❌ FATAL: Model Load Failed: {e}", flush=True)
         sys.exit(1)
 
+    await prewarm_upstreams()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if embed_batcher: embed_batcher.stop()
+    if http_client: await http_client.aclose()
+    gpu_executor.shutdown(wait=False)
+
 # --- HELPER FUNCTIONS ---
+async def prewarm_upstreams():
+    # DNS + TCP + TLS up front, so the first research call finds a pooled connection waiting
+    await asyncio.gather(*(http_client.head(host, timeout=3) for host in UPSTREAM_HOSTS), return_exceptions=True)
+
+def load_embedder():
+    if EMBED_BACKEND == "onnx":
+        import onnxruntime as ort
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = EMBED_THREADS
+        # Same encode() API; int8 VNNI/NEON dot products + fused graph instead of fp32 PyTorch
+        return SentenceTransformer(
+            EMBEDDING_MODEL, backend="onnx",
+            model_kwargs={
+                "file_name": EMBED_ONNX_FILE,
+                "provider": "CPUExecutionProvider",
+                "session_options": sess_options,
+            }
+        )
+    if torch.backends.mps.is_available():
+        # fp16 Metal kernels: half the memory traffic; normalized cosine top-k is stable at 384 dims
+        return SentenceTransformer(EMBEDDING_MODEL, device="mps").half()
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+_RE_UNITS = re.compile(r'\b\d+(ml|g|kg|L|oz)\b', re.IGNORECASE)
+_RE_PAREN = re.compile(r'\(.*?\)|pack of \d+|official|review', re.IGNORECASE)
+_RE_STOP = re.compile(r'\b(for|with|and|flavor|flavour|variant)\b', re.IGNORECASE)
+_RE_WS = re.compile(r'\s+')
+
+# Sentiment cues: positive outranks negative; search() stops at the first hit in each
+_POS_RE = re.compile(r'\b(love|great|excellent|buy|amazing|yes)\b', re.IGNORECASE)
+_NEG_RE = re.compile(r'\b(hate|bad|terrible|avoid|expensive|no)\b', re.IGNORECASE)
+
 def clean_query_step(query):
     original = query
-    query = re.sub(r'\b\d+(ml|g|kg|L|oz)\b', '', query, flags=re.IGNORECASE)
-    query = re.sub(r'\(.*?\)|pack of \d+|official|review', '', query, flags=re.IGNORECASE)
-    query = re.sub(r'\b(for|with|and|flavor|flavour|variant)\b', '', query, flags=re.IGNORECASE)
-    query = " ".join(query.split()) 
+    query = _RE_UNITS.sub('', query)
+    query = _RE_PAREN.sub('', query)
+    query = _RE_STOP.sub('', query)
+    query = _RE_WS.sub(' ', query).strip()
     if query == original:
         tokens = query.split()
         if len(tokens) > 1: query = " ".join(tokens[:-1])
     return query
 
-def perform_federated_research(topic, audience_context):
-    voices = []
-    current_q = topic
-    for _ in range(3): 
-        try:
-            url = f"https://www.reddit.com/search.json?q={urllib.parse.quote(current_q)}&sort=relevance&limit=8"
-            resp = requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=5)
-            if resp.status_code == 200:
-                posts = resp.json().get('data', {}).get('children', [])
-                if posts:
-                    for p in posts:
-                        title = p['data']['title']
-                        if len(title) > 15: voices.append(title)
-                    break 
-        except: pass
-        new_q = clean_query_step(current_q)
-        if new_q == current_q: break
-        current_q = new_q
+def relaxation_chain(query, steps=3):
+    # The successive clean_query_step variants the serial retry loop would have tried
+    chain = [query]
+    while len(chain) < steps:
+        relaxed = clean_query_step(chain[-1])
+        if relaxed == chain[-1]: break
+        chain.append(relaxed)
+    return chain
+
+async def _search_reddit(query):
+    # None means "no threads for this variant": the caller falls through to the next one
+    try:
+        url = f"https://www.reddit.com/search.json?q={urllib.parse.quote(query)}&sort=relevance&limit=8"
+        resp = await http_client.get(url, timeout=5)
+        if resp.status_code == 200:
+            posts = resp.json().get('data', {}).get('children', [])
+            if posts:
+                return [p['data']['title'] for p in posts if len(p['data']['title']) > 15]
+    except: pass
+    return None
 
-    wiki_summary = ""
-    brand_guess = topic.split()[0]
+async def _search_wikipedia(brand_guess):
     try:
         url = "https://en.wikipedia.org/w/api.php"
         params = {
             "action": "query", "format": "json", "prop": "extracts",
             "exintro": True, "explaintext": True, "titles": brand_guess
         }
-        resp = requests.get(url, params=params, headers={'User-Agent': USER_AGENT}, timeout=4)
+        resp = await http_client.get(url, params=params, timeout=4)
         data = resp.json().get("query", {}).get("pages", {})
         for _, page in data.items():
             if "extract" in page:
-                wiki_summary = page["extract"][:300]
-                voices.append(f"[Context] Brand Background: {wiki_summary}...")
-                break
+                return f"[Context] Brand Background: {page['extract'][:300]}..."
     except: pass
+    return None
+
+def _topic_key(topic):
+    return " ".join(topic.lower().split())
+
+async def perform_federated_research(topic, audience_context):
+    key = _topic_key(topic)
+    cached = _research_cache.get(key)
+    if cached is not None: return cached
+
+    # Every relaxation variant and Wikipedia go out at once; the first variant with threads wins,
+    # so latency is one round trip instead of up to three serial Reddit calls plus Wikipedia
+    variants = relaxation_chain(topic)
+    *reddit, wiki_voice = await asyncio.gather(
+        *(_search_reddit(q) for q in variants), _search_wikipedia(topic.split()[0])
+    )
+    voices = next((titles for titles in reddit if titles is not None), [])
+    if wiki_voice: voices.append(wiki_voice)
 
     if not voices:
         return ["SYSTEM_ALERT: No digital footprint found. The product might be too new or niche."]
     
-    return list(set(voices))[:15]
+    # Dedupe keeping relevance order (set() shuffled it before truncating)
+    result = list(dict.fromkeys(voices))[:15]
+    _research_cache.put(key, result)
+    return result
 
-def perform_fact_check(query):
-    current_q = query
-    for _ in range(3):
-        try:
-            url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={urllib.parse.quote(current_q)}&search_simple=1&action=process&json=1"
-            resp = requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=6)
-            products = resp.json().get('products', [])
-            
-            if products:
-                p = products[0]
-                specs = (
-                    f"Product: {p.get('product_name', 'Unknown')}\n"
-                    f"Brand: {p.get('brands', 'Unknown')}\n"
-                    f"NutriScore: {p.get('nutriscore_grade', '?').upper()}\n"
-                    f"Ingredients: {', '.join(p.get('ingredients_tags', [])[:5])}..."
-                )
-                return specs
-        except: pass
-        new_q = clean_query_step(current_q)
-        if new_q == current_q: break
-        current_q = new_q
+async def _search_off(query):
+    # None means "no products for this variant": the caller falls through to the next one
+    try:
+        url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={urllib.parse.quote(query)}&search_simple=1&action=process&json=1"
+        resp = await http_client.get(url)
+        products = resp.json().get('products', [])
+        if products: return products[0]
+    except: pass
+    return None
+
+async def perform_fact_check(query):
+    key = _topic_key(query)
+    cached = _facts_cache.get(key)
+    if cached is not None: return cached
 
-    return "SYSTEM_ALERT: No structured data found in Open Databases."
+    # All relaxation variants go out at once; the first in relaxation order with products wins
+    matches = await asyncio.gather(*(_search_off(q) for q in relaxation_chain(query)))
+    p = next((m for m in matches if m is not None), None)
+    if p is None:
+        return "SYSTEM_ALERT: No structured data found in Open Databases."
+
+    specs = (
+        f"Product: {p.get('product_name', 'Unknown')}\n"
+        f"Brand: {p.get('brands', 'Unknown')}\n"
+        f"NutriScore: {p.get('nutriscore_grade', '?').upper()}\n"
+        f"Ingredients: {', '.join(p.get('ingredients_tags', [])[:5])}..."
+    )
+    _facts_cache.put(key, specs)
+    return specs
+
+def ensure_vector_index(tbl, rebuild=False):
+    # IVF-PQ turns the O(N) flat scan into a partition probe over compressed codes
+    rows = tbl.count_rows()
+    if rows < ANN_INDEX_MIN_ROWS: return
+    if not rebuild and any("vector" in idx.columns for idx in tbl.list_indices()): return
+    tbl.create_index(
+        metric="cosine",
+        num_partitions=max(1, int(math.sqrt(rows))),
+        num_sub_vectors=48,
+        vector_column_name="vector",
+        replace=True
+    )
+    print(f"✅ BRAIN: Vector index built over {rows} rows", flush=True)
+
+def _rebuild_index_worker(rebuild=True):
+    global _rows_since_index
+    if not _index_lock.acquire(blocking=False): return  # A rebuild is already running
+    try:
+        _rows_since_index = 0
+        ensure_vector_index(knowledge_table, rebuild=rebuild)
+    except Exception as e:
+        print(f"⚠️ BRAIN: Vector index unavailable, using flat scan ({e})", flush=True)
+    finally:
+        _index_lock.release()
+
+def note_memory_bank_insert(count):
+    # Rows added after training land in the index's unindexed tail; retrain periodically
+    global _rows_since_index
+    _rows_since_index += count
+    if _rows_since_index >= ANN_REINDEX_EVERY:
+        threading.Thread(target=_rebuild_index_worker, daemon=True).start()
+
+def _embed_key(text):
+    return hashlib.sha256(text.encode()).digest()
+
+def _encode(texts, batch_size):
+    return embed_model.encode(
+        texts, batch_size=batch_size,
+        normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+    )
+
+def encode_texts(texts, batch_size=32):
+    # ONNX Runtime CPU sessions are thread-safe and never touch Metal: only torch embeds queue on the GPU thread
+    if EMBED_BACKEND == "torch":
+        return gpu_executor.submit(_encode, texts, batch_size).result()
+    return _encode(texts, batch_size)
+
+def _encode_and_cache(texts, keys, batch_size=32):
+    fresh = encode_texts(texts, batch_size).astype(np.float32, copy=False)
+    for key, vec in zip(keys, fresh):
+        vec.flags.writeable = False  # Shared between callers via the cache
+        _embed_cache.put(key, vec)
+    return fresh
+
+def embed_many(texts, batch_size=32):
+    # Cached texts are served from memory; only the misses go through one batched encode
+    keys = [_embed_key(t) for t in texts]
+    vecs = [_embed_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vecs) if v is None]
+    if missing:
+        fresh = _encode_and_cache([texts[i] for i in missing], [keys[i] for i in missing], batch_size)
+        for i, vec in zip(missing, fresh): vecs[i] = vec
+    return np.stack(vecs)
+
+async def embed_async(text):
+    # Request-path embeds: cache first, then coalesce with concurrent requests
+    key = _embed_key(text)
+    vec = _embed_cache.get(key)
+    if vec is None: vec = await embed_batcher.embed(text, key)
+    return vec
+
+def search_memory_bank(q_vec, limit=5):
+    key = hashlib.blake2b(q_vec.tobytes(), digest_size=8).digest()
+    cached = _hits_cache.get(key)
+    if cached is not None:
+        return cached
+
+    query = knowledge_table.search(q_vec.astype(np.float16)).metric("cosine")
+    query = query.nprobes(ANN_NPROBES).refine_factor(ANN_REFINE_FACTOR)  # No-ops until an index exists
+    texts = [h["text"] for h in query.limit(limit).to_list()]
+    if texts:
+        # Misses are not cached: the live fallback may fill the gap on the next call
+        _hits_cache.put(key, texts)
+    return texts
+
+def fetch_live_hits(query):
+    with DDGS() as ddgs:
+        return list(ddgs.text(f"{query} review india", max_results=4))
+
+def _should_speculate(key):
+    # The bank lookup is milliseconds, DDG is seconds: start DDG early when the bank will likely miss
+    if knowledge_table.count_rows() < SPECULATE_MIN_ROWS: return True
+    misses, lookups = _recall_stats.get(key, (0, 0))
+    return lookups >= SPECULATE_MIN_LOOKUPS and misses / lookups >= SPECULATE_MISS_RATE
+
+def _record_recall(key, hit):
+    stats = _recall_stats.get(key)
+    if stats is None:
+        if len(_recall_stats) >= RECALL_STATS_SIZE:
+            _recall_stats.pop(next(iter(_recall_stats)), None)
+        stats = _recall_stats.setdefault(key, [0, 0])
+    stats[0] += 0 if hit else 1
+    stats[1] += 1
+
+def search_pdf_table(tbl, q_vec):
+    query = tbl.search(q_vec.astype(np.float16)).metric("cosine")
+    hits = query.nprobes(ANN_NPROBES).refine_factor(ANN_REFINE_FACTOR).limit(2).to_list()
+    return "".join(f"- {h['text'][:200]}...\n" for h in hits)
+
+def write_back_live_hits(texts):
+    # Runs as a background task after the response is sent: nobody is waiting for the error
+    try:
+        vecs = embed_many(texts)  # One batched forward pass for all uncached hits
+        now = int(time.time())  # Epoch seconds, matching the int64 date column from ingestion
+        new_data = [{
+            "text": text,
+            "source": "live_ddg",
+            "category": "live_fallback",
+            "score": 10,
+            "date": now,
+            "vector": vec
+        } for text, vec in zip(texts, vecs.astype(np.float16))]
+        knowledge_table.add(new_data)
+        note_memory_bank_insert(len(new_data))
+    except Exception as e:
+        print(f"⚠️ BRAIN: Live write-back failed ({e})", flush=True)
 
 def get_sharded_context(agent_name, topic):
-    if not memory_graph.has_node(topic): return ""
-    all_opinions = []
-    for peer in memory_graph.predecessors(topic):
-        if peer == agent_name: continue
-        edge = memory_graph.get_edge_data(peer, topic)
-        all_opinions.append(f"- {peer}: \"{edge.get('content','...')}\"")
+    opinions = memory_by_topic.get(topic)
+    if not opinions: return ""
+    all_opinions = [f"- {peer}: \"{content}\"" for peer, (content, _) in list(opinions.items()) if peer != agent_name]
     
     if not all_opinions: return ""
-    shard_index = sum(ord(c) for c in agent_name) % 3
+    shard_index = agent_shards.get(agent_name)
+    if shard_index is None:
+        shard_index = agent_shards[agent_name] = zlib.crc32(agent_name.encode()) % 3
     shard_size = max(1, len(all_opinions) // 2)
     start = (shard_index * shard_size) % len(all_opinions)
     selected = all_opinions[start : start + 3]
     return "\n[WHAT OTHERS ARE SAYING - YOUR FEED]:\n" + "\n".join(selected) + "\n"
 
-def process_pdf(pdf_b64):
+def _window_text(pages, window):
+    # Cut the original page text (case, accents, emoji intact) spanned by a token window
+    parts = []
+    i = 0
+    while i < len(window):
+        page = window[i][0]
+        j = i
+        while j + 1 < len(window) and window[j + 1][0] == page: j += 1
+        parts.append(pages[page][window[i][1]:window[j][2]])
+        i = j + 1
+    return "\n".join(parts)
+
+def iter_pdf_chunks(pdf_data):
+    # Pages stream through a rolling token buffer; only pages still referenced by it are held
+    tok = embed_model.tokenizer
+    reader = PdfReader(io.BytesIO(pdf_data))
+    pages = {}    # page number -> extracted text
+    pending = []  # (page number, char start, char end) per token
+    emitted = False
+    for n, page in enumerate(reader.pages):
+        text = page.extract_text() or ""
+        offsets = tok(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)["offset_mapping"]
+        if not offsets: continue
+        pages[n] = text
+        pending.extend((n, start, end) for start, end in offsets)
+        while len(pending) >= PDF_CHUNK_TOKENS:
+            yield _window_text(pages, pending[:PDF_CHUNK_TOKENS])
+            del pending[:PDF_CHUNK_STRIDE]
+            emitted = True
+        oldest = pending[0][0] if pending else n + 1
+        for done in [k for k in pages if k < oldest]: del pages[done]
+    # Partial tail window, only if it holds tokens the last full window did not cover
+    if len(pending) > (PDF_CHUNK_TOKENS - PDF_CHUNK_STRIDE if emitted else 0):
+        yield _window_text(pages, pending)
+
+def process_pdf(pdf_data):
     try:
-        pdf_data = base64.b64decode(pdf_b64)
-        reader = PdfReader(io.BytesIO(pdf_data))
-        text = "".join([page.extract_text() for page in reader.pages])
-        words = text.split()
-        return [" ".join(words[i:i+200]) for i in range(0, len(words), 150)]
+        # Chunk on real token boundaries so every chunk fits the encoder unchanged
+        return list(iter_pdf_chunks(pdf_data))
     except: return []
 
+def _pdf_fingerprint(pdf_b64):
+    # Length + head + tail: O(1) in PDF size; the PDF trailer (xref offsets, /ID) sits in the tail
+    edge = PDF_FINGERPRINT_EDGE
+    sample = f"{len(pdf_b64)}:{pdf_b64[:edge]}{pdf_b64[-edge:]}"
+    return hashlib.blake2b(sample.encode(), digest_size=8).digest()
+
+def get_pdf_table(pdf_b64):
+    key = _pdf_fingerprint(pdf_b64)
+    tbl = _pdf_table_cache.get(key)
+    if tbl is not None: return tbl
+
+    # Decode once: the raw bytes feed both the content hash and the text extraction
+    pdf_data = base64.b64decode(pdf_b64)
+    pdf_hash = hashlib.blake2b(pdf_data, digest_size=16).hexdigest()
+    table_name = f"doc_{pdf_hash}"
+    with _pdf_table_lock:
+        if table_name not in _known_tables:
+            chunks = process_pdf(pdf_data)
+            if chunks:
+                vecs = encode_texts(chunks, batch_size=64)
+                data = [{"vector": v, "text": t} for v, t in zip(vecs.astype(np.float16), chunks)]
+                new_tbl = db.create_table(table_name, data=data, schema=PDF_TABLE_SCHEMA)
+                _known_tables.add(table_name)  # Only once creation has succeeded
+                # Only book-length PDFs cross ANN_INDEX_MIN_ROWS; the rest stay on flat scan
+                try: ensure_vector_index(new_tbl)
+                except Exception as e: print(f"⚠️ BRAIN: PDF index skipped ({e})", flush=True)
+        tbl = db.open_table(table_name)
+    _pdf_table_cache[key] = tbl
+    return tbl
+
+def decode_image(image_b64):
+    key = hashlib.sha1(image_b64.encode()).digest()
+    img = _image_cache.get(key)
+    if img is not None: return img
+
+    img = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+    # JPEG only (no-op otherwise): skip decoding pixels the VLM would downscale away
+    img.draft("RGB", IMAGE_DRAFT_SIZE)
+    img.load()  # Decode now so the source buffer can be freed before inference
+    # draft() is a no-op for PNG and only gets JPEG to >= the box: bound the cached pixels for real
+    img.thumbnail(IMAGE_DRAFT_SIZE)
+    _image_cache.put(key, img)
+    return img
+
+def build_prompt(prompt, context, with_image):
+    # One scan for the user tag and one join: RAG + feed context makes this tens of KB
+    image_tag = "\n<|image_1|>" if with_image and "<|image_1|>" not in prompt else ""
+    u_idx = prompt.find(USER_TAG)
+    if u_idx == -1:
+        head, tail = USER_TAG, prompt
+    else:
+        split = u_idx + len(USER_TAG)
+        head, tail = prompt[:split], prompt[split:]
+    return "".join((head, image_tag, "\n", context, "\n", tail, END_MARKER, "\n<|assistant|>"))
+
+def run_generation(full_prompt, images, max_tokens, temperature):
+    # CRITICAL: run only on gpu_executor
+    # Only one thread can run generation at a time on Metal
+    pieces = []
+    for chunk in stream_generate(model, processor, full_prompt, images, max_tokens=max_tokens, temp=temperature):
+        if not chunk.text: continue
+        pieces.append(chunk.text)
+        # Non-empty pieces: the marker can span at most len(END_MARKER) of them
+        if END_MARKER in "".join(pieces[-len(END_MARKER):]): break
+    return "".join(pieces).split(END_MARKER)[0].strip()
+
 def _update_graph_memory(agent_name, response_text, topic):
     try:
-        sentiment = 0.0
-        lower = response_text.lower()
-        if "love" in lower or "great" in lower: sentiment = 1.0
-        elif "hate" in lower or "bad" in lower: sentiment = -1.0
-        memory_graph.add_node(agent_name, type="agent")
-        memory_graph.add_node(topic, type="topic")
-        memory_graph.add_edge(agent_name, topic, relation="has_opinion", weight=sentiment, content=response_text[:120])
+        sentiment = 1.0 if _POS_RE.search(response_text) else (-1.0 if _NEG_RE.search(response_text) else 0.0)
+        with memory_lock:
+            memory_by_topic[topic][agent_name] = (response_text[:120], sentiment)
     except: pass 
 
 # --- API ENDPOINTS ---
@@ -206,8 +673,19 @@ def _update_graph_memory(agent_name, response_text, topic):
 def health_check():
     return {"status": "ready"}
 
+@app.get("/cache_stats")
+def cache_stats():
+    return {
+        "status": "success",
+        "embeddings": _embed_cache.stats(),
+        "memory_hits": _hits_cache.stats(),
+        "research": _research_cache.stats(),
+        "facts": _facts_cache.stats(),
+        "images": _image_cache.stats(),
+    }
+
 @app.post("/generate")
-def generate_text(req: GenerateRequest):
+async def generate_text(req: GenerateRequest, background: BackgroundTasks):
     try:
         agent = "Unknown"
         topic = "General"
@@ -216,53 +694,28 @@ def generate_text(req: GenerateRequest):
 
         sharded_ctx = get_sharded_context(agent, topic)
         
-        # PDF RAG (Needs GPU for embedding)
+        # PDF RAG (embedding queues on the GPU thread only for the torch backend)
         rag_ctx = ""
         if req.pdf:
-            pdf_hash = hashlib.md5(req.pdf.encode()).hexdigest()
-            table_name = f"doc_{pdf_hash}"
-            
-            # LOCK GPU for embedding
-            with gpu_lock:
-                if table_name not in db.table_names():
-                    chunks = process_pdf(req.pdf)
-                    if chunks:
-                        vecs = embed_model.encode(chunks)
-                        data = [{"vector": v, "text": t} for v, t in zip(vecs, chunks)]
-                        db.create_table(table_name, data=data)
-                tbl = db.open_table(table_name)
-                q_vec = embed_model.encode([req.prompt])[0]
+            tbl = await run_in_threadpool(get_pdf_table, req.pdf)
+            q_vec = await embed_async(req.prompt)
             
-            # DB search is CPU bound, safe outside lock
-            res = tbl.search(q_vec).limit(2).to_pandas()
-            for _, r in res.iterrows(): rag_ctx += f"- {r['text'][:200]}...\n"
-
-        final_context = f"{rag_ctx}\n{sharded_ctx}"
-        full_prompt = req.prompt
-        if "<|user|>" in full_prompt:
-            full_prompt = full_prompt.replace("<|user|>", f"<|user|>\n{final_context}\n", 1) + "<|end|>\n<|assistant|>"
-        else:
-            full_prompt = f"<|user|>\n{final_context}\n{full_prompt}<|end|>\n<|assistant|>"
+            # DB search is CPU bound, runs off the GPU thread
+            rag_ctx = await run_in_threadpool(search_pdf_table, tbl, q_vec)
 
         images = None
         if req.image:
-            try:
-                img = Image.open(io.BytesIO(base64.b64decode(req.image)))
-                images = [img]
-                if "<|image_1|>" not in full_prompt:
-                     full_prompt = full_prompt.replace("<|user|>", "<|user|>\n<|image_1|>", 1)
+            try: images = [await run_in_threadpool(decode_image, req.image)]
             except: pass
 
-        # CRITICAL: GPU INFERENCE MUST BE LOCKED
-        # Only one thread can run 'generate' at a time on Metal
-        with gpu_lock:
-            if images:
-                 res = generate(model, processor, full_prompt, images, max_tokens=req.max_tokens, temp=req.temperature, verbose=False)
-            else:
-                 res = generate(model, processor, full_prompt, max_tokens=req.max_tokens, temp=req.temperature, verbose=False)
-            
-        final_text = res.text.split("<|end|>")[0].strip()
-        _update_graph_memory(agent, final_text, topic)
+        final_context = f"{rag_ctx}\n{sharded_ctx}"
+        full_prompt = build_prompt(req.prompt, final_context, bool(images))
+
+        final_text = await asyncio.get_running_loop().run_in_executor(
+            gpu_executor, run_generation, full_prompt, images, req.max_tokens, req.temperature
+        )
+        # Feed update doesn't shape this response; do it after it is sent
+        background.add_task(_update_graph_memory, agent, final_text, topic)
         
         return {"status": "success", "text": final_text}
 
@@ -271,57 +724,46 @@ def generate_text(req: GenerateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/query_memory")
-def query_memory_endpoint(req: QueryRequest):
+async def query_memory_endpoint(req: QueryRequest, background: BackgroundTasks):
     results = []
+    web_future = None
     
-    # 1. Try Offline DB First
+    # 1. Try Offline DB First (racing the web search if the bank is likely to miss)
     if knowledge_table:
+        key = " ".join(req.query.lower().split())
         try:
-            # LOCK GPU for embedding
-            with gpu_lock:
-                q_vec = embed_model.encode([req.query])[0]
-            
-            hits = knowledge_table.search(q_vec).limit(5).to_list()
-            if hits:
-                results = [h["text"] for h in hits]
+            if ENABLE_LIVE_FALLBACK and await run_in_threadpool(_should_speculate, key):
+                web_future = _web_pool.submit(fetch_live_hits, req.query)
+            q_vec = await embed_async(req.query)
+            results = list(await run_in_threadpool(search_memory_bank, q_vec))
         except: pass
+        _record_recall(key, bool(results))
     
     # 2. Live Fallback
-    if not results:
+    if results and web_future:
+        web_future.cancel()  # Bank answered; a web call already in flight is simply dropped
+    elif not results and ENABLE_LIVE_FALLBACK:
         try:
-            with DDGS() as ddgs:
-                web_hits = list(ddgs.text(f"{req.query} review india", max_results=4))
-                new_data = []
-                for hit in web_hits:
-                    text = f"[LIVE WEB] {hit['title']}: {hit['body']}"
-                    results.append(text)
-                    if knowledge_table:
-                        # LOCK GPU for embedding
-                        with gpu_lock:
-                            vec = embed_model.encode([text])[0]
-                        new_data.append({
-                            "text": text,
-                            "source": "live_ddg",
-                            "category": "live_fallback",
-                            "score": 10,
-                            "date": datetime.datetime.now().isoformat(),
-                            "vector": vec
-                        })
-                if new_data and knowledge_table:
-                    knowledge_table.add(new_data)
+            if web_future: web_hits = await asyncio.wrap_future(web_future)
+            else: web_hits = await run_in_threadpool(fetch_live_hits, req.query)
+            texts = [f"[LIVE WEB] {hit['title']}: {hit['body']}" for hit in web_hits]
+            results.extend(texts)
+            if texts and knowledge_table:
+                # Embed + insert happen after the response is sent
+                background.add_task(write_back_live_hits, texts)
         except Exception as e:
             results.append(f"Web Search Failed: {str(e)}")
             
     return {"status": "success", "data": results}
 
 @app.post("/research")
-def research_endpoint(req: ResearchRequest):
-    voices = perform_federated_research(req.product, req.context)
+async def research_endpoint(req: ResearchRequest):
+    voices = await perform_federated_research(req.product, req.context)
     return {"status": "success", "research_data": voices}
 
 @app.post("/get_facts")
-def facts_endpoint(req: QueryRequest):
-    fact = perform_fact_check(req.query)
+async def facts_endpoint(req: QueryRequest):
+    fact = await perform_fact_check(req.query)
     return {"status": "success", "fact_sheet": fact}
 
 if __name__ == "__main__":
@@ -5,6 +5,8 @@
 import os
 import json
 import lancedb
+import numpy as np
+import pyarrow as pa
 from sentence_transformers import SentenceTransformer
 
 # CONFIGURATION
@@ -12,6 +14,17 @@ DB_PATH = "./knowledge_db"
 # This file must be generated by 'filter_reddit.py' first
 FILTERED_DATA_PATH = "./python_bridge/filtered_india_context.jsonl" 
 MODEL_NAME = "all-MiniLM-L6-v2"
+VECTOR_DIM = 384
+
+# Vectors stored as float16: halves the bytes scanned per query and the disk footprint
+MEMORY_SCHEMA = pa.schema([
+    pa.field("text", pa.string()),
+    pa.field("source", pa.string()),
+    pa.field("category", pa.string()),
+    pa.field("score", pa.int64()),
+    pa.field("date", pa.int64()),
+    pa.field("vector", pa.list_(pa.float16(), VECTOR_DIM)),
+])
 
 def build_knowledge_base():
     print(f"🧠 KNOWLEDGE BUILDER: Initializing at {DB_PATH}...")
@@ -73,7 +86,9 @@ def build_knowledge_base():
         
         # Create Embeddings
         texts = [d["text"] for d in batch]
-        vectors = model.encode(texts)
+        vectors = model.encode(
+            texts, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+        ).astype(np.float16)
         
         # Attach vectors to data objects
         batch_data = []
@@ -84,7 +99,7 @@ def build_knowledge_base():
         # Write to DB
         if table is None:
             # Create table with first batch
-            table = db.create_table(table_name, data=batch_data, mode="overwrite")
+            table = db.create_table(table_name, data=batch_data, schema=MEMORY_SCHEMA, mode="overwrite")
         else:
             # Append subsequent batches
             table.add(data=batch_data)
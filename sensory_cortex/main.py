@@ -1,6 +1,7 @@
 import asyncio
 import ollama
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from crawl4ai import AsyncWebCrawler
 
@@ -8,6 +9,16 @@ app = FastAPI()
 
 # --- CONFIG ---
 MODEL_NAME = "qwen2.5"
+MAX_PAGE_CHARS = 15000     # Crawled markdown handed to the model
+PAGE_TIMEOUT_MS = 10000    # Give up on pages that take longer than this to render
+# MAX_PAGE_CHARS of link-heavy markdown is ~4-5k tokens; 8192 leaves room for the prompt
+# and the 256-token answer, so Ollama never truncates the start of the page
+OLLAMA_OPTIONS = {"num_ctx": 8192, "num_predict": 256}
+SYSTEM_PROMPT = "You are the Oraculum Cortex. Extract the requested facts from the raw data. Be concise."
+
+# Non-blocking client: generation no longer stalls the event loop for other requests
+llm = ollama.AsyncClient()
+crawler = None  # One headless browser for the app's lifetime, opened at startup
 
 # Input Schema (What Rust sends)
 class SensoryRequest(BaseModel):
@@ -18,30 +29,45 @@ class SensoryRequest(BaseModel):
 class SensoryResponse(BaseModel):
     knowledge: str
 
+# --- LIFECYCLE ---
+@app.on_event("startup")
+async def startup_event():
+    global crawler
+    crawler = AsyncWebCrawler(verbose=False)
+    await crawler.__aenter__()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if crawler: await crawler.__aexit__(None, None, None)
+
+# --- HELPERS ---
+async def crawl_page(url):
+    # 1. THE EYE (Crawl4AI)
+    result = await crawler.arun(url=url, bypass_cache=True, page_timeout=PAGE_TIMEOUT_MS)
+
+    if not result.markdown:
+        raise HTTPException(status_code=500, detail="Failed to acquire visual data")
+    return result.markdown[:MAX_PAGE_CHARS]
+
+def build_messages(raw_data, query):
+    return [
+        {'role': 'system', 'content': SYSTEM_PROMPT},
+        {'role': 'user', 'content': f"Raw Data:\n{raw_data}\n\nUser Goal: {query}"}
+    ]
+
+# --- API ENDPOINTS ---
 @app.post("/perceive", response_model=SensoryResponse)
 async def perceive(request: SensoryRequest):
     print(f"\n[ORACULUM REQUEST] Scanning: {request.url} for '{request.query}'")
-    
+
     try:
-        # 1. THE EYE (Crawl4AI)
-        async with AsyncWebCrawler(verbose=False) as crawler:
-            result = await crawler.arun(url=request.url, bypass_cache=True)
-            
-            if not result.markdown:
-                raise HTTPException(status_code=500, detail="Failed to acquire visual data")
+        raw_data = await crawl_page(request.url)
 
         # 2. THE BRAIN (Ollama)
-        response = ollama.chat(model=MODEL_NAME, messages=[
-            {
-                'role': 'system',
-                'content': "You are the Oraculum Cortex. Extract the requested facts from the raw data. Be concise."
-            },
-            {
-                'role': 'user',
-                'content': f"Raw Data:\n{result.markdown[:15000]}\n\nUser Goal: {request.query}"
-            }
-        ])
-        
+        response = await llm.chat(
+            model=MODEL_NAME, messages=build_messages(raw_data, request.query), options=OLLAMA_OPTIONS
+        )
+
         knowledge = response['message']['content']
         print(f"[ORACULUM RESPONSE] {knowledge}")
         return SensoryResponse(knowledge=knowledge)
@@ -50,4 +76,31 @@ async def perceive(request: SensoryRequest):
         print(f"[ERROR] {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/perceive_stream")
+async def perceive_stream(request: SensoryRequest):
+    # Same pipeline as /perceive, but tokens are sent as Ollama produces them
+    print(f"\n[ORACULUM STREAM] Scanning: {request.url} for '{request.query}'")
+
+    try:
+        raw_data = await crawl_page(request.url)
+        stream = await llm.chat(
+            model=MODEL_NAME, messages=build_messages(raw_data, request.query),
+            options=OLLAMA_OPTIONS, stream=True
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def relay():
+        try:
+            async for chunk in stream:
+                text = chunk['message']['content']
+                if text: yield text.encode()
+        except Exception as e:
+            print(f"[ERROR] {e}")
+
+    return StreamingResponse(relay(), media_type="text/plain; charset=utf-8")
+
 # Run with: python -m uvicorn oraculum_server:app --reload
\ No newline at end of file
@@ -1,101 +1,297 @@
-import requests
-import json
+import asyncio
+import functools
+import logging
+import logging.handlers
+import queue
+import sys
+import aiohttp
+import ijson
+import orjson
+import random
 import urllib.parse
 import time
 
 # --- CONFIGURATION ---
 USER_AGENT = 'OraculumMarketBot/1.0 (Student Project)'
+HEADERS = {'User-Agent': USER_AGENT}
+CACHE_MAXSIZE = 256   # Distinct queries kept per channel
+REDDIT_TTL = 300      # Threads move fast
+WIKI_TTL = 3600       # Brand pages rarely change
+OFF_TTL = 1800        # Product records change occasionally
+POOL_LIMIT = 100      # Open connections across all upstreams
+POOL_PER_HOST = 10    # Keep-alive connections per upstream host
+DNS_CACHE_TTL = 300   # Seconds a resolved upstream address is reused
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle pooled connection is kept open
+# A dead host fails on connect in 2s; a stalled response fails after 4s without a byte
+REDDIT_TIMEOUT = aiohttp.ClientTimeout(connect=2, sock_read=4)
+WIKI_TIMEOUT = aiohttp.ClientTimeout(connect=2, sock_read=4)
+OFF_TIMEOUT = aiohttp.ClientTimeout(connect=2, sock_read=4)
+SCOUT_BUDGET = 8.0    # Seconds per target, retries included; late channels are dropped
+SCOUT_CONCURRENCY = 8 # Targets scouted at once in a bulk run
+RETRY_ATTEMPTS = 3    # Extra tries after the first, for rate limits / outages / timeouts only
+BACKOFF_BASE = 0.5    # Seconds before the first retry; doubles each attempt
+BACKOFF_MAX = 8.0     # Cap on any single wait, Retry-After included
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BREAKER_THRESHOLD = 5   # Consecutive failed fetches before a channel is switched off
+BREAKER_COOLDOWN = 30   # Seconds a tripped channel stays off before it is tried again
+OFF_FIELDS = "product_name,brands,nutriscore_grade,quantity,ingredients_tags,labels"
+# OpenFoodFacts only knows food: skip it for queries that are clearly something else
+NON_FOOD_HINTS = {
+    "phone", "smartphone", "laptop", "tablet", "gpu", "cpu", "headphones", "earbuds", "speaker",
+    "tv", "television", "monitor", "camera", "console", "car", "bike", "scooter", "watch",
+    "charger", "shoes", "shirt", "jeans", "furniture", "mattress",
+}
+FOOD_HINTS = {
+    "lassi", "milk", "protein", "chips", "cola", "juice", "tea", "coffee", "chocolate", "biscuit",
+    "biscuits", "cereal", "bar", "snack", "drink", "yogurt", "curd", "cheese", "butter", "ghee",
+    "noodles", "sauce", "water", "soda", "icecream", "bread", "oats",
+}
+# Ask for exactly the threads the report uses, so the whole body is read and the socket stays pooled
+REDDIT_URL_TMPL = "https://www.reddit.com/search.json?q={}&sort=relevance&limit=3"
+# Top match only, and only the fields the report reads (full records run to hundreds of KB)
+OFF_URL_TMPL = (
+    "https://world.openfoodfacts.org/cgi/search.pl?search_terms={}&search_simple=1&action=process&json=1"
+    f"&fields={OFF_FIELDS}&page_size=1"
+)
 
-def fetch_reddit_voices(query):
+# --- LOGGING ---
+# One JSON line per channel result; records are written by a listener thread, never on the event loop
+log = logging.getLogger("oraculum.scout")
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {"ts": round(record.created, 3), "level": record.levelname, "event": record.getMessage()}
+        event.update(getattr(record, "fields", {}))
+        return orjson.dumps(event).decode()
+
+def log_event(event, level=logging.INFO, **fields):
+    log.log(level, event, extra={"fields": fields})
+
+def start_logging():
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener.start()
+    return listener
+
+# --- SHARED HTTP SESSION ---
+# One connector per process: DNS answers, TLS sessions and keep-alive sockets survive across scouts
+_SESSION = None
+
+def get_session():
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT, limit_per_host=POOL_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT, enable_cleanup_closed=True
+        )
+        # No session timeout: each channel passes its own ClientTimeout, which replaces it outright
+        _SESSION = aiohttp.ClientSession(headers=HEADERS, connector=connector)
+    return _SESSION
+
+async def close_session():
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
+# --- RESPONSE CACHES ---
+# query -> (expires_at, payload). Only successful lookups are stored; errors always re-fetch.
+_REDDIT_CACHE = {}
+_WIKI_CACHE = {}
+_OFF_CACHE = {}
+
+def cache_get(cache, key):
+    entry = cache.get(key)
+    if entry is None: return None
+    if entry[0] < time.monotonic():
+        del cache[key]
+        return None
+    return entry
+
+def cache_put(cache, key, payload, ttl):
+    if len(cache) >= CACHE_MAXSIZE:
+        cache.pop(next(iter(cache)))  # Oldest insertion first
+    cache[key] = (time.monotonic() + ttl, payload)
+
+# --- CIRCUIT BREAKERS ---
+# channel -> consecutive failures + when it may be tried again
+_BREAKER = {name: {'failures': 0, 'open_until': 0.0} for name in ('reddit', 'wiki', 'off')}
+
+def breaker_open(name):
+    return time.monotonic() < _BREAKER[name]['open_until']
+
+def breaker_record(name, ok):
+    state = _BREAKER[name]
+    if ok:
+        state['failures'] = 0
+        return
+    state['failures'] += 1
+    if state['failures'] >= BREAKER_THRESHOLD:
+        state['open_until'] = time.monotonic() + BREAKER_COOLDOWN
+        # Half-open: one more failure (the first call after the cooldown) re-trips at once
+        state['failures'] = BREAKER_THRESHOLD - 1
+
+@functools.lru_cache(maxsize=1024)
+def quote_query(query):
+    return urllib.parse.quote(query)
+
+@functools.lru_cache(maxsize=4096)
+def brand_of(query):
+    # Heuristic: the first word is the brand ("Amul Protein Lassi 200ml" -> "Amul"); case is kept for the title lookup
+    tokens = query.split()
+    return tokens[0] if tokens else ""
+
+# --- TRANSIENT-FAILURE RETRIES ---
+def backoff_delay(attempt, retry_after=None):
+    # The server's own hint wins; otherwise capped exponential with +/-30% jitter
+    if retry_after and retry_after.isdigit():
+        return min(BACKOFF_MAX, float(retry_after))
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return delay + random.uniform(-delay * 0.3, delay * 0.3)
+
+async def read_json(resp):
+    return orjson.loads(await resp.read())
+
+def read_items(prefix, limit):
+    # Streams the array at `prefix`, keeping at most `limit` items
+    async def read(resp):
+        items = []
+        async for item in ijson.items(resp.content, prefix, use_float=True):
+            items.append(item)
+            if len(items) >= limit: break
+        # Drain any remainder: aiohttp closes (not pools) a connection whose body was left unread
+        await resp.content.read()
+        return items
+    return read
+
+async def get_json(session, url, timeout, params=None, read=read_json):
+    """
+    GET + decode JSON, retrying 429/5xx and timeouts/connection drops.
+    Any other error status raises immediately.
+    """
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        try:
+            async with session.get(url, params=params, timeout=timeout) as resp:
+                if resp.status in RETRY_STATUSES and attempt < RETRY_ATTEMPTS:
+                    delay = backoff_delay(attempt, resp.headers.get("Retry-After"))
+                else:
+                    resp.raise_for_status()
+                    return await read(resp)
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+            if attempt == RETRY_ATTEMPTS: raise
+            delay = backoff_delay(attempt)
+        log_event("retry", logging.WARNING, url=url, attempt=attempt + 1, delay=round(delay, 2))
+        await asyncio.sleep(delay)
+
+async def fetch_reddit_voices(session, query):
     """
     Channel 1: The 'Voice of the People'
     Fetches raw discussions from Reddit. Zero HTML parsing.
     """
-    print(f"\n📢 CHANNEL 1: Reddit Voices (Query: '{query}')...")
-    url = f"https://www.reddit.com/search.json?q={urllib.parse.quote(query)}&sort=relevance&limit=5"
-    headers = {'User-Agent': USER_AGENT}
+    key = query.strip().lower()
+    cached = cache_get(_REDDIT_CACHE, key)
+    if cached:
+        log_event("reddit_result", query=query, status="cached", threads=len(cached[1]))
+        return cached[1]
+    if breaker_open('reddit'):
+        log_event("reddit_result", logging.WARNING, query=query, status="circuit_open")
+        return []
+    url = REDDIT_URL_TMPL.format(quote_query(query))
     
     try:
-        resp = requests.get(url, headers=headers, timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            posts = data.get('data', {}).get('children', [])
-            
-            if posts:
-                print(f"   ✅ SUCCESS: Found {len(posts)} threads.")
-                voices = []
-                for p in posts[:3]:
-                    title = p['data']['title']
-                    score = p['data']['score']
-                    print(f"      - \"{title}\" (Score: {score})")
-                    voices.append(title)
-                return voices
-            else:
-                print("   ⚠️  Reddit silent on this exact topic.")
-                return []
-        else:
-            print(f"   ❌ Reddit API Status: {resp.status_code}")
-            return []
+        posts = await get_json(session, url, REDDIT_TIMEOUT, read=read_items('data.children.item', 3))
+        breaker_record('reddit', True)
+        
+        voices = [p['data']['title'] for p in posts]
+        scores = [p['data']['score'] for p in posts]
+        cache_put(_REDDIT_CACHE, key, voices, REDDIT_TTL)
+        # "empty": Reddit silent on this exact topic
+        log_event("reddit_result", query=query, status="ok" if voices else "empty",
+                  threads=len(voices), titles=voices, scores=scores)
+        return voices
     except Exception as e:
-        print(f"   ❌ Connection Error: {e}")
+        breaker_record('reddit', False)
+        log_event("reddit_result", logging.ERROR, query=query, status="error", error=str(e))
         return []
 
-def fetch_wikipedia_context(query):
+async def fetch_wikipedia_context(session, query):
     """
     Channel 2: The 'Brand Authority'
     Fetches the corporate identity and history.
     """
-    # Extract the Brand Name (heuristic: first word or two)
-    brand_guess = query.split()[0]
-    print(f"\n🏛️ CHANNEL 2: Wikipedia Authority (Query: '{brand_guess}')...")
+    # Extract the Brand Name in its original case ("PepsiCo", "ITC"): Wikipedia titles are case-sensitive
+    brand_guess = brand_of(query.strip())
+    key = brand_guess.lower()  # Casing variants share one cache entry
+    cached = cache_get(_WIKI_CACHE, key)
+    if cached:
+        log_event("wiki_result", brand=brand_guess, status="cached", chars=len(cached[1]))
+        return cached[1]
+    if breaker_open('wiki'):
+        log_event("wiki_result", logging.WARNING, brand=brand_guess, status="circuit_open")
+        return ""
     
     url = "https://en.wikipedia.org/w/api.php"
     params = {
         "action": "query",
         "format": "json",
         "prop": "extracts",
-        "exintro": True,
-        "explaintext": True,
+        "exintro": 1,
+        "explaintext": 1,
+        "exchars": 500,  # Truncated server-side: only the opening lines identify the brand
+        "redirects": 1,  # Alternate spellings / casings resolve to the canonical page
         "titles": brand_guess
     }
     
     try:
-        resp = requests.get(url, params=params, headers={'User-Agent': USER_AGENT}, timeout=5)
-        data = resp.json()
+        data = await get_json(session, url, WIKI_TIMEOUT, params)
+        breaker_record('wiki', True)
         pages = data.get("query", {}).get("pages", {})
         
-        for page_id, page_data in pages.items():
-            if page_id != "-1":
-                extract = page_data.get("extract", "")
-                snippet = extract[:200].replace('\n', ' ')
-                print(f"   ✅ SUCCESS: Verified Entity.")
-                print(f"      - {snippet}...")
-                return extract
-            
-        print("   ⚠️  Entity not found on Wikipedia.")
-        return ""
+        # Page id "-1" means the entity is not on Wikipedia
+        extract = next((page.get("extract", "") for page_id, page in pages.items() if page_id != "-1"), "")
+        cache_put(_WIKI_CACHE, key, extract, WIKI_TTL)
+        log_event("wiki_result", brand=brand_guess, status="ok" if extract else "empty",
+                  chars=len(extract), snippet=extract[:200].replace('\n', ' '))
+        return extract
     except Exception as e:
-        print(f"   ❌ Wikipedia Error: {e}")
+        breaker_record('wiki', False)
+        log_event("wiki_result", logging.ERROR, brand=brand_guess, status="error", error=str(e))
         return ""
 
-def fetch_product_specs(query):
+async def fetch_product_specs(session, query):
     """
     Channel 3: The 'Hard Facts' (Open Database)
     Tries OpenFoodFacts first. Best for FMCG/Beverages.
     """
-    print(f"\n📦 CHANNEL 3: Product Specifications (Query: '{query}')...")
+    key = query.strip().lower()
+    words = set(key.split())
+    if not words.isdisjoint(NON_FOOD_HINTS) and words.isdisjoint(FOOD_HINTS):
+        log_event("off_result", query=query, status="skipped_non_food")
+        return ""
+    cached = cache_get(_OFF_CACHE, key)
+    if cached:
+        log_event("off_result", query=query, status="cached", found=bool(cached[1]))
+        return cached[1]
+    if breaker_open('off'):
+        log_event("off_result", logging.WARNING, query=query, status="circuit_open")
+        return ""
     
     # 1. Try OpenFoodFacts (World's largest open food DB)
-    off_url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={urllib.parse.quote(query)}&search_simple=1&action=process&json=1"
+    off_url = OFF_URL_TMPL.format(quote_query(query))
     
     try:
-        resp = requests.get(off_url, headers={'User-Agent': USER_AGENT}, timeout=8)
-        data = resp.json()
+        # page_size=1 + fields= keep this body tiny: read it whole so the connection is reused
+        data = await get_json(session, off_url, OFF_TIMEOUT)
         products = data.get('products', [])
+        breaker_record('off', True)
         
         if products:
             p = products[0] # Top match
-            print(f"   ✅ SUCCESS: Found Data in OpenFoodFacts!")
             
             # Extract key marketing data
             specs = {
@@ -107,31 +303,64 @@ def fetch_product_specs(query):
                 "Labels": p.get('labels', 'None')
             }
             
-            for k, v in specs.items():
-                print(f"      - {k}: {v}")
-            
-            return json.dumps(specs)
+            specs_json = orjson.dumps(specs).decode()
+            cache_put(_OFF_CACHE, key, specs_json, OFF_TTL)
+            log_event("off_result", query=query, status="ok", specs=specs)
+            return specs_json
             
         else:
-            print("   ⚠️  Not found in Food DB. (If this was Tech, we'd query a different DB).")
+            # Not in the Food DB (if this was Tech, we'd query a different DB)
+            cache_put(_OFF_CACHE, key, "", OFF_TTL)
+            log_event("off_result", query=query, status="empty")
             return ""
             
     except Exception as e:
-        print(f"   ❌ Specs Fetch Error: {e}")
+        breaker_record('off', False)
+        log_event("off_result", logging.ERROR, query=query, status="error", error=str(e))
         return ""
 
+async def scout(session, target):
+    tasks = [
+        asyncio.create_task(fetch_reddit_voices(session, target)),
+        asyncio.create_task(fetch_wikipedia_context(session, target)),
+        asyncio.create_task(fetch_product_specs(session, target)),
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=SCOUT_BUDGET)
+    for task in pending:
+        task.cancel()
+    if pending:
+        log_event("budget_exhausted", logging.WARNING, target=target, budget=SCOUT_BUDGET, dropped=len(pending))
+        await asyncio.gather(*pending, return_exceptions=True)
+    return [t.result() if t in done and not t.exception() else None for t in tasks]
+
+async def scout_many(targets):
+    # Every channel of every target shares the process-wide connection pool
+    session = get_session()
+    # At most SCOUT_CONCURRENCY targets in flight, so bulk runs stay inside upstream rate limits
+    sem = asyncio.Semaphore(SCOUT_CONCURRENCY)
+
+    async def bounded(target):
+        async with sem:
+            return await scout(session, target)
+
+    return await asyncio.gather(*(bounded(t) for t in targets))
+
+async def main(targets):
+    print(f"--- STARTING FEDERATED SCOUT FOR: {', '.join(targets)} ---")
+    listener = start_logging()
+    try:
+        results = await scout_many(targets)
+    finally:
+        await close_session()  # Shutdown: release pooled sockets before the loop closes
+        listener.stop()  # Flushes queued records before the report
+    
+    for target, (voices, context, facts) in zip(targets, results):
+        print(f"\n--- FEDERATION REPORT: {target} ---")
+        if voices: print(f"✅ Voices: Acquired ({len(voices)} threads)")
+        if context: print(f"✅ Context: Acquired ({len(context)} chars)")
+        if facts: print(f"✅ Facts: Acquired (Structured JSON)")
+        if not (voices or context or facts): print("❌ SYSTEM FAILURE: All channels silent.")
+
 if __name__ == "__main__":
     # Test with your specific product
-    target = "Amul Protein Lassi"
-    
-    print(f"--- STARTING FEDERATED SCOUT FOR: {target} ---")
-    
-    voices = fetch_reddit_voices(target)
-    context = fetch_wikipedia_context(target)
-    facts = fetch_product_specs(target)
-    
-    print("\n--- FEDERATION REPORT ---")
-    if voices: print(f"✅ Voices: Acquired ({len(voices)} threads)")
-    if context: print(f"✅ Context: Acquired ({len(context)} chars)")
-    if facts: print(f"✅ Facts: Acquired (Structured JSON)")
-    if not (voices or context or facts): print("❌ SYSTEM FAILURE: All channels silent.")
\ No newline at end of file
+    asyncio.run(main(["Amul Protein Lassi"]))
\ No newline at end of file
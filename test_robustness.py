@@ -1,6 +1,11 @@
 import re
 import random
-import json
+import time
+
+# --- SEMANTIC CACHE CONFIG ---
+SEMANTIC_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_THRESHOLD = 0.92   # Cosine similarity above which two inputs count as the same search
+SEMANTIC_TTL = 24 * 3600    # Seconds a resolved search is reused
 
 # --- MOCK DATA (Simulating what our Scout found) ---
 # In production, this comes from the Reddit/Wiki APIs we just tested.
@@ -23,7 +28,21 @@ MOCK_FACTS = {
     "protein": "15g"
 }
 
+# Product keys in our (simulated) DB; any input naming one resolves without relaxation
+KNOWN_PRODUCTS = {"amul protein lassi"}
+# One scan of the input against every key at once (longest key wins on overlap)
+_RE_KNOWN = re.compile("|".join(map(re.escape, sorted(KNOWN_PRODUCTS, key=len, reverse=True))))
+
 # --- LOGIC 1: RECURSIVE QUERY RELAXATION ---
+# Compiled once: clean_query_step runs on every relaxation attempt.
+# One alternation (units | pack/parentheticals | stopwords) strips all noise in a single scan.
+_RE_NOISE = re.compile(
+    r'\b\d+(?:ml|g|kg|L|oz)\b'
+    r'|\(.*?\)|pack of \d+'
+    r'|\b(?:for|with|and|flavor|flavour|variant)\b',
+    re.IGNORECASE
+)
+
 def clean_query_step(query):
     """
     Intelligently strips noise from a query to find the 'Core Identity'.
@@ -31,14 +50,9 @@ def clean_query_step(query):
     """
     original = query
     
-    # Step 1: Remove specific measurements (200ml, 1kg, 500g)
-    query = re.sub(r'\b\d+(ml|g|kg|L|oz)\b', '', query, flags=re.IGNORECASE)
-    
-    # Step 2: Remove "Pack of X" or parentheticals
-    query = re.sub(r'\(.*?\)|pack of \d+', '', query, flags=re.IGNORECASE)
-    
-    # Step 3: Remove common stopwords/prepositions
-    query = re.sub(r'\b(for|with|and|flavor|flavour|variant)\b', '', query, flags=re.IGNORECASE)
+    # Steps 1-3: Remove measurements (200ml, 1kg, 500g), "Pack of X" / parentheticals,
+    # and common stopwords/prepositions
+    query = _RE_NOISE.sub('', query)
     
     # Step 4: Collapse whitespace
     query = " ".join(query.split())
@@ -51,16 +65,70 @@ def clean_query_step(query):
             
     return query
 
+# --- LOGIC 1b: SEMANTIC CACHE ---
+# brand -> [(expires_at, unit embedding, result)]; namespacing keeps other brands out of the scan
+_semantic_cache = {}
+_embedder = None  # Loaded on first use; False if sentence-transformers is unavailable
+
+def embed_input(text):
+    global _embedder
+    if _embedder is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+            _embedder = SentenceTransformer(SEMANTIC_MODEL)
+        except Exception as e:
+            # Not installed, or the model can't be fetched (offline, no HF cache)
+            print(f"   ⚠️  Semantic cache disabled: {e}")
+            _embedder = False
+    if not _embedder: return None
+    return _embedder.encode(text, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+
+def semantic_lookup(brand, vec):
+    """
+    Returns the cached result of the closest earlier input, or None if nothing is close enough.
+    """
+    now = time.monotonic()
+    entries = [e for e in _semantic_cache.get(brand, []) if e[0] > now]
+    _semantic_cache[brand] = entries
+    best_score, best_result = 0.0, None
+    for _, cached_vec, result in entries:
+        score = float(vec.dot(cached_vec))  # Unit vectors: dot product == cosine
+        if score > best_score: best_score, best_result = score, result
+    if best_score > SEMANTIC_THRESHOLD:
+        print(f"   ♻️  SEMANTIC HIT (cosine {best_score:.3f}): reusing earlier result.")
+        return best_result
+    return None
+
+def semantic_store(brand, vec, result):
+    _semantic_cache.setdefault(brand, []).append((time.monotonic() + SEMANTIC_TTL, vec, result))
+
 def robust_search_simulation(messy_input):
     print(f"\n🔍 ROBUSTNESS TEST: Input = '{messy_input}'")
+    known = _RE_KNOWN.search(messy_input.lower())
+    if known:
+        print(f"   ✅ SUCCESS: Known product '{known.group()}' named directly, no relaxation needed.")
+        return True
+
+    tokens = messy_input.split()
+    brand = tokens[0].lower() if tokens else ""
+    vec = embed_input(messy_input)
+    if vec is not None:
+        cached = semantic_lookup(brand, vec)
+        if cached is not None: return cached
+
+    result = relaxed_search(messy_input)
+    if vec is not None: semantic_store(brand, vec, result)
+    return result
+
+def relaxed_search(messy_input):
     current_q = messy_input
     
     # Simulate API attempts
     for attempt in range(4):
         print(f"   Attempt {attempt+1}: Searching for '{current_q}'...")
         
-        # SIMULATION: We pretend 'Amul Protein Lassi' is the only valid key in our DB
-        if "amul protein lassi" in current_q.lower() and len(current_q) < 25:
+        # SIMULATION: We pretend KNOWN_PRODUCTS are the only valid keys in our DB
+        if len(current_q) < 25 and _RE_KNOWN.search(current_q.lower()):
             print("   ✅ SUCCESS: Match found in Database!")
             return True
             
@@ -74,43 +142,42 @@ def robust_search_simulation(messy_input):
     return False
 
 # --- LOGIC 2: CONTEXT SHARDING (SCALABILITY) ---
-def shard_context(agent_id, total_agents, all_voices, facts):
+def make_sharder(all_voices, facts):
     """
     Slices the world's knowledge so different agents see different things.
+    Shards are cut once; every agent gets a shared (read-only) reference to its slice.
     """
-    # 1. Determine the 'Lens' based on Agent ID
     # Agents are split into clusters
     shard_size = max(1, len(all_voices) // 3)
-    
-    if agent_id % 3 == 0:
-        # Cluster A: Optimists (First 1/3rd of comments)
-        my_voices = all_voices[:shard_size]
-        focus = "Positive Reviews"
-    elif agent_id % 3 == 1:
-        # Cluster B: Critics (Middle 1/3rd of comments)
-        my_voices = all_voices[shard_size:shard_size*2]
-        focus = "Critical Reviews"
-    else:
-        # Cluster C: Realists (Last 1/3rd)
-        my_voices = all_voices[shard_size*2:]
-        focus = "Recent Issues"
-
-    return {
-        "agent_id": agent_id,
-        "focus_lens": focus,
-        "knowledge_fragment": my_voices,
-        "facts": facts # Everyone sees facts
-    }
+    shards = (
+        all_voices[:shard_size],              # Cluster A: Optimists (First 1/3rd of comments)
+        all_voices[shard_size:shard_size*2],  # Cluster B: Critics (Middle 1/3rd of comments)
+        all_voices[shard_size*2:],            # Cluster C: Realists (Last 1/3rd)
+    )
+    foci = ("Positive Reviews", "Critical Reviews", "Recent Issues")
+    # One pre-filled context per cluster; each agent only adds its ID
+    templates = tuple(
+        {"focus_lens": focus, "knowledge_fragment": shard, "facts": facts} # Everyone sees facts
+        for focus, shard in zip(foci, shards)
+    )
+
+    def shard_context(agent_id, total_agents):
+        # The 'Lens' is picked by Agent ID
+        return {"agent_id": agent_id, **templates[agent_id % 3]}
+    return shard_context
 
 if __name__ == "__main__":
     # TEST 1: Handle a terrible user input
     user_input = "Amul Protein Lassi (Rose Flavour) 200ml Pack of 6 for Gym"
     robust_search_simulation(user_input)
+    # Noise splits the product name: only relaxation can recover it
+    robust_search_simulation("Amul Protein (Rose Flavour) Lassi 200ml")
     
     # TEST 2: Scale to 10 Agents with Sharding
     print(f"\n👥 SCALABILITY TEST: Generating unique contexts for 10 agents...")
+    sharder = make_sharder(MOCK_VOICES, MOCK_FACTS)
     for i in range(1, 11):
-        context = shard_context(i, 10, MOCK_VOICES, MOCK_FACTS)
+        context = sharder(i, 10)
         print(f"   Agent {i} sees [{context['focus_lens']}]: {len(context['knowledge_fragment'])} specific comments.")
         # Print sample for Agent 6 to prove they see different stuff than Agent 1
         if i == 6: